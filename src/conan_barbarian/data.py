@@ -2,45 +2,76 @@
 Data strctures to keep information about libraries, the symbols they define and their dependencies.
 """
 
-from collections.abc import Collection
-from pathlib import PurePath, Path
+from collections import deque
+from collections.abc import Collection, Iterable
+from pathlib import Path
+import functools
+import os
 import json
-from typing import Optional
+import sys
+from types import ModuleType
+from typing import Any, Optional, Union
+
+orjson: Optional[ModuleType]
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import ijson  # type: ignore[import-untyped]
+except ImportError:
+    ijson = None
+
+try:
+    import msgpack  # type: ignore[import-untyped]
+except ImportError:
+    msgpack = None
+
+# project files with these suffixes are stored with msgpack instead of JSON, if msgpack is installed
+BINARY_SUFFIXES = ('.bin', '.msgpack')
+# JSON project files at least this big are parsed incrementally, if ijson is installed
+STREAMING_LOAD_SIZE = 256 * 1024 * 1024
+
 
 class Library:
-    __slots__ = ("name", "filename", "system", "package", "_dependencies")
+    __slots__ = ("name", "filename", "system", "_dependencies")
 
     name: str
     filename: str
     system: bool
-    _dependencies: set[str]
-    package: str
+    # frozen until the first change, for libraries loaded from file
+    _dependencies: Union[set[str], frozenset[str]]
 
     def __init__(self, filename, system=False):
         self.name = strip_library_name(filename)
-        self.filename = filename
+        self.filename = sys.intern(filename)
         self.system = system
         self._dependencies = set()
 
     @property
     def dependencies(self):
+        if isinstance(self._dependencies, frozenset):
+            return self._dependencies
         return frozenset(self._dependencies)
     
     def add_dependency(self, dependency: str):
+        if not isinstance(self._dependencies, set):
+            self._dependencies = set(self._dependencies)
         self._dependencies.add(dependency)
 
     @staticmethod
     def from_json(data):
         lib = Library(data['file'], data['system'])
-        for dependency in data.get('needs', []):
-            lib.add_dependency(dependency)
+        lib._dependencies = frozenset(sys.intern(dependency) for dependency in data.get('needs', ()))
         return lib
     
     def to_json(self):
         return {
             'file': self.filename,
             'system': self.system,
-            "needs": self._dependencies
+            # sorted, so that saved projects do not depend on set iteration order
+            "needs": sorted(self._dependencies)
         }
 
     def __repr__(self):
@@ -57,21 +88,32 @@ class Library:
 
 class Cache:
     _filepath: Optional[Path]
+    _pretty: bool
     _libraries: dict[str, Library]
+    _by_filename: dict[str, Library]
     _defined_symbols: dict[str, str]
-    _undefined_symbols: dict[str, set[str]]
+    # values are tuples until the first change, for symbols loaded from file
+    _undefined_symbols: dict[str, Union[set[str], tuple[str, ...]]]
     _packages: dict[str, set[str]]
     _components: dict[str, set[str]]
     _libs2components: dict[str, str]
+    _transitive_dependencies: dict[str, frozenset[str]]
+    _defined_by_file: dict[str, set[str]]
+    _undefined_by_file: dict[str, set[str]]
 
-    def __init__(self, path: Optional[Path] = None):
+    def __init__(self, path: Optional[Path] = None, *, pretty=False):
         self._filepath = path
+        self._pretty = pretty
         self._libraries = {}
+        self._by_filename = {}
         self._defined_symbols = {}
         self._undefined_symbols = {}
         self._packages = {}
         self._components = {}
         self._libs2components = {}
+        self._transitive_dependencies = {}
+        self._defined_by_file = {}
+        self._undefined_by_file = {}
 
     def list_libraries(self):
         return self._libraries.values()
@@ -80,12 +122,18 @@ class Cache:
         return [lib.filename for lib in self._libraries.values()]
 
     def is_library(self, library: str):
-        return strip_library_name(library) in self._libraries
+        return library in self._by_filename or strip_library_name(library) in self._libraries
     
     def get_library(self, library: str):
+        lib = self._by_filename.get(library)
+        if lib is not None:
+            return lib
         lib_name = strip_library_name(library)
         lib = self._libraries.get(lib_name)
-        if lib and _different_extension(library, lib.filename):
+        if lib is None or library == lib.filename:
+            # fast path: no need to compare extensions
+            return lib
+        if _different_extension(library, lib.filename):
             return None
         return lib
     
@@ -95,7 +143,12 @@ class Cache:
 
     def add_library(self, library: str, *, system=False, package=None):
         lib = Library(library, system=system)
+        replaced = self._libraries.get(lib.name)
+        if replaced is not None:
+            del self._by_filename[replaced.filename]
         self._libraries[lib.name] = lib
+        self._by_filename[lib.filename] = lib
+        self._transitive_dependencies.clear()
         if package:
             self._packages.setdefault(package, set()).add(lib.name)
 
@@ -103,56 +156,115 @@ class Cache:
         lib = self._libraries.pop(strip_library_name(library), None)
         if not lib:
             return
-        self._defined_symbols = {key:val for key, val in self._defined_symbols.items() if val != lib.filename}
-
-        unneeded_symbols = []
-        for key, val in self._undefined_symbols.items():
-            try:
-                val.remove(lib.filename)
-                if len(val) == 0:
-                    unneeded_symbols.append(key)
-            except KeyError:
-                pass
-        for symbol in unneeded_symbols:
-            del self._undefined_symbols[symbol]
+        del self._by_filename[lib.filename]
+        self._transitive_dependencies.clear()
+        for symbol in self._defined_by_file.pop(lib.filename, ()):
+            if self._defined_symbols.get(symbol) == lib.filename:
+                del self._defined_symbols[symbol]
+
+        for symbol in self._undefined_by_file.pop(lib.filename, ()):
+            needing_libs = self.__libraries_needing_symbol(symbol)
+            if needing_libs is not None:
+                needing_libs.discard(lib.filename)
+                if len(needing_libs) == 0:
+                    del self._undefined_symbols[symbol]
 
     def add_dependency(self, src, tgt):
-        src_name = strip_library_name(src)
         if src != tgt:
-            self._libraries[src_name].add_dependency(tgt)
-
-    def get_dependencies(self, library: str, *, transitive=False):
+            src_lib = self._by_filename.get(src) or self._libraries[strip_library_name(src)]
+            src_lib.add_dependency(tgt)
+            self._transitive_dependencies.clear()
+
+    def add_dependencies(self, dependencies: Iterable[tuple[str, str]]):
+        """Adds many (src, tgt) dependencies at once"""
+        by_filename = self._by_filename
+        for src, tgt in dependencies:
+            if src != tgt:
+                src_lib = by_filename.get(src) or self._libraries[strip_library_name(src)]
+                src_lib.add_dependency(tgt)
+        self._transitive_dependencies.clear()
+
+    def get_dependencies(self, library: str, *, transitive=False, shared=False):
+        """
+        Returns a new set with the dependencies of a library.
+        With shared, returns a read-only frozenset kept by the cache instead of a copy.
+        """
         lib = self.get_library(library)
         if not lib:
             raise Exception(f'{library} is not a library')
-        lib_deps = set(lib.dependencies)
         if transitive:
-            queue = list(lib_deps)
-            while len(queue) > 0:
-                item = queue.pop()
-                lib_deps.add(item)
-                item_lib = self.get_library(item)
-                if item_lib:
-                    item_deps = item_lib.dependencies
-                    new_deps = item_deps - lib_deps
-                    queue.extend(new_deps)
-        return lib_deps
+            closure = self.__transitive_dependencies(lib)
+            return closure if shared else set(closure)
+        if shared:
+            return lib.dependencies
+        return set(lib._dependencies)
+
+    def __transitive_dependencies(self, lib: Library):
+        """Computes the transitive dependencies of a library, reusing those computed for other libraries"""
+        cached = self._transitive_dependencies.get(lib.name)
+        if cached is not None:
+            return cached
+        lib_deps = set(lib._dependencies)
+        queue = deque(lib_deps)
+        while queue:
+            item = queue.popleft()
+            item_lib = self.get_library(item)
+            if not item_lib:
+                continue
+            item_closure = self._transitive_dependencies.get(item_lib.name)
+            if item_closure is not None:
+                # already complete, no need to visit its dependencies
+                lib_deps.update(item_closure)
+                continue
+            for dep in item_lib._dependencies:
+                if dep not in lib_deps:
+                    lib_deps.add(dep)
+                    queue.append(dep)
+        cached = frozenset(lib_deps)
+        self._transitive_dependencies[lib.name] = cached
+        return cached
     
     # Symbols
 
     @property
     def defined_symbols(self):
-        return frozenset(self._defined_symbols.keys())
+        """Live read-only view of the defined symbols"""
+        return self._defined_symbols.keys()
     
     @property
     def undefined_symbols(self):
-        return frozenset(self._undefined_symbols.keys())
+        """Live read-only view of the symbols needed but not defined yet"""
+        return self._undefined_symbols.keys()
     
     def define_symbol(self, symbol: str, library_file: str):
         """Adds the definition of a symbol, and returns a set of libraries that need that symbol"""
         assert self.get_library(library_file)
         self._defined_symbols[symbol] = library_file
-        results = self._undefined_symbols.pop(symbol, set())
+        file_symbols = self._defined_by_file.get(library_file)
+        if file_symbols is None:
+            self._defined_by_file[library_file] = {symbol}
+        else:
+            file_symbols.add(symbol)
+        results = self._undefined_symbols.pop(symbol, None)
+        if results is None:
+            return set()
+        return results if isinstance(results, set) else set(results)
+
+    def define_symbols(self, symbols: Collection[str], library_file: str):
+        """
+        Adds the definitions of all the symbols of a library with bulk updates,
+        and returns a set of libraries that need any of them
+        """
+        assert self.get_library(library_file)
+        self._defined_symbols.update(dict.fromkeys(symbols, library_file))
+        file_symbols = self._defined_by_file.get(library_file)
+        if file_symbols is None:
+            self._defined_by_file[library_file] = set(symbols)
+        else:
+            file_symbols.update(symbols)
+        results: set[str] = set()
+        for symbol in self._undefined_symbols.keys() & symbols:
+            results.update(self._undefined_symbols.pop(symbol))
         return results
 
     def get_library_defining_symbol(self, symbol: str):
@@ -160,7 +272,38 @@ class Cache:
         return self._defined_symbols.get(symbol)
     
     def add_undefined_symbol_dependency(self, symbol, library_file):
-        self._undefined_symbols.setdefault(symbol, set()).add(library_file)
+        needing_libs = self.__libraries_needing_symbol(symbol)
+        if needing_libs is None:
+            self._undefined_symbols[symbol] = {library_file}
+        else:
+            needing_libs.add(library_file)
+        file_symbols = self._undefined_by_file.get(library_file)
+        if file_symbols is None:
+            self._undefined_by_file[library_file] = {symbol}
+        else:
+            file_symbols.add(symbol)
+
+    def add_undefined_symbols_dependency(self, symbols: Collection[str], library_file: str):
+        """Records with bulk updates that a library needs many symbols not defined yet"""
+        for symbol in symbols:
+            needing_libs = self.__libraries_needing_symbol(symbol)
+            if needing_libs is None:
+                self._undefined_symbols[symbol] = {library_file}
+            else:
+                needing_libs.add(library_file)
+        file_symbols = self._undefined_by_file.get(library_file)
+        if file_symbols is None:
+            self._undefined_by_file[library_file] = set(symbols)
+        else:
+            file_symbols.update(symbols)
+
+    def __libraries_needing_symbol(self, symbol):
+        """Returns the modifiable set of libraries needing a symbol, or None"""
+        needing_libs = self._undefined_symbols.get(symbol)
+        if needing_libs is not None and not isinstance(needing_libs, set):
+            needing_libs = set(needing_libs)
+            self._undefined_symbols[symbol] = needing_libs
+        return needing_libs
 
     def libraries_needing_undefined_symbol(self, symbol):
         return frozenset(self._undefined_symbols.get(symbol, []))
@@ -180,15 +323,20 @@ class Cache:
         return self._components.get(component, set())
     
     def set_component_libraries(self, component: str, libraries: list[str]):
+        for lib in self._components.get(component, ()):
+            name = strip_library_name(lib)
+            # the library may have been claimed by another component in the meantime
+            if self._libs2components.get(name) == component:
+                del self._libs2components[name]
         self._components[component] = set(libraries)
+        for lib in libraries:
+            self._libs2components[strip_library_name(lib)] = component
 
     def get_library_component(self, lib: str):
-        if len(self._components) > 0 and len(self._libs2components) == 0:
-            self.__build_components_reverse_map()
-
         return self._libs2components.get(strip_library_name(lib), None)
 
     def __build_components_reverse_map(self):
+        self._libs2components = {}
         for comp, libs in self._components.items():
             for lib in libs:
                 self._libs2components[strip_library_name(lib)] = comp
@@ -209,39 +357,163 @@ class Cache:
             'components': self._components,
         }
 
+    @property
+    def is_binary(self):
+        return msgpack is not None and self._filepath is not None and self._filepath.suffix in BINARY_SUFFIXES
+
     def load(self):
         try:
-            with open(self._filepath, 'r') as f:
-                data = json.load(f)
+            with open(self._filepath, 'rb') as f:
+                # the format is chosen by the content, not the suffix: JSON files always start with '{'
+                head = f.read(1)
+                f.seek(0)
+                if head and head != b'{' and not head.isspace():
+                    if msgpack is None:
+                        raise Exception(f'{self._filepath} is a binary project file, msgpack is required to read it')
+                    data = msgpack.unpackb(f.read())
+                elif ijson and os.fstat(f.fileno()).st_size >= STREAMING_LOAD_SIZE:
+                    data = _stream_loads(f)
+                else:
+                    data = _loads(f.read())
                 libraries = [Library.from_json(lib) for lib in data['libraries']]
                 self._libraries = {lib.name: lib for lib in libraries}
+                self._by_filename = {lib.filename: lib for lib in libraries}
                 self._packages = {k: set(v) for k, v in data['packages'].items()}
-                self._defined_symbols = data['defined']
-                self._undefined_symbols = {k: set(v) for k, v in data['undefined'].items()}
+                # library filenames are repeated for every symbol, share a single string per file
+                intern = sys.intern
+                self._defined_symbols = {k: intern(v) for k, v in data['defined'].items()}
+                self._undefined_symbols = {k: tuple(intern(x) for x in v) for k, v in data['undefined'].items()}
                 self._components = {k: set(v) for k, v in data['components'].items()}
+                self.__build_components_reverse_map()
+                self._transitive_dependencies = {}
+                self.__build_symbols_index()
         except FileNotFoundError:
             pass
 
+    def __build_symbols_index(self):
+        self._defined_by_file = {}
+        for symbol, library_file in self._defined_symbols.items():
+            file_symbols = self._defined_by_file.get(library_file)
+            if file_symbols is None:
+                self._defined_by_file[library_file] = {symbol}
+            else:
+                file_symbols.add(symbol)
+        self._undefined_by_file = {}
+        for symbol, library_files in self._undefined_symbols.items():
+            for library_file in library_files:
+                file_symbols = self._undefined_by_file.get(library_file)
+                if file_symbols is None:
+                    self._undefined_by_file[library_file] = {symbol}
+                else:
+                    file_symbols.add(symbol)
+
+    def to_plain_data(self):
+        """
+        Same content as to_json, made only of dicts, lists and scalars, so that serializers
+        never need to call json_encoder
+        """
+        return {
+            'libraries': [{'file': lib.filename, 'system': lib.system, 'needs': sorted(lib._dependencies)}
+                          for lib in self._libraries.values()],
+            'defined': self._defined_symbols,
+            'undefined': {k: list(v) for k, v in self._undefined_symbols.items()},
+            'packages': {k: list(v) for k, v in self._packages.items()},
+            'components': {k: list(v) for k, v in self._components.items()},
+        }
+
     def save(self):
             if not self._filepath:
                 raise('cannot save cache: file path not set')
-            with open(self._filepath, 'w') as f:
-                json.dump(self, f, indent=2, default=json_encoder)
+            data = self.to_plain_data()
+            with open(self._filepath, 'wb') as f:
+                if self.is_binary:
+                    f.write(msgpack.packb(data))
+                else:
+                    f.write(_dumps(data, indent=self._pretty))
 
 
+@functools.lru_cache(maxsize=None)
 def strip_library_name(name):
-    return PurePath(name).stem.removeprefix('lib')
+    basename = name.rpartition('/')[2]
+    suffix = _suffix(basename)
+    if suffix:
+        basename = basename[:-len(suffix)]
+    # interned, so that names computed from different filenames share one string
+    return sys.intern(basename.removeprefix('lib'))
+
+
+def _suffix(name):
+    """Same as PurePath(name).suffix, without building a path object"""
+    basename = name.rpartition('/')[2]
+    pos = basename.rfind('.')
+    if 0 < pos < len(basename) - 1:
+        return basename[pos:]
+    return ''
 
 
 def _different_extension(first, second):
-    ext1 = PurePath(first).suffix
-    ext2 = PurePath(second).suffix
+    ext1 = _suffix(first)
+    ext2 = _suffix(second)
     return ext1 and ext1 != ext2
 
 
+def _loads(data: bytes):
+    if orjson:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def _stream_loads(f) -> dict:
+    """
+    Parses a project file with ijson, without reading the whole file in memory.
+    The symbol maps, by far the biggest sections, are filled directly from the parser events.
+    """
+    data: dict[str, Any] = {}
+    defined: dict[str, str] = {}
+    undefined: dict[str, list[str]] = {}
+    section: str = ''
+    builder: Optional[ijson.ObjectBuilder] = None
+    symbol: str = ''
+    needing_libs: list[str] = []
+    for prefix, event, value in ijson.parse(f):
+        if prefix == '':
+            if builder is not None:
+                data[section] = builder.value
+                builder = None
+            if event == 'map_key':
+                section = value
+                if section not in ('defined', 'undefined'):
+                    builder = ijson.ObjectBuilder()
+        elif section == 'defined':
+            if event == 'map_key':
+                symbol = value
+            elif event == 'string':
+                defined[symbol] = sys.intern(value)
+        elif section == 'undefined':
+            if event == 'map_key':
+                symbol = value
+                needing_libs = undefined[symbol] = []
+            elif event == 'string':
+                needing_libs.append(sys.intern(value))
+        else:
+            assert builder is not None
+            builder.event(event, value)
+    data['defined'] = defined
+    data['undefined'] = undefined
+    return data
+
+
+def _dumps(obj, indent=False) -> bytes:
+    if orjson:
+        return orjson.dumps(obj, default=json_encoder, option=orjson.OPT_INDENT_2 if indent else None)
+    if indent:
+        return json.dumps(obj, indent=2, default=json_encoder).encode('utf-8')
+    return json.dumps(obj, separators=(',', ':'), default=json_encoder).encode('utf-8')
+
+
 def json_encoder(obj):
     if getattr(obj.__class__, 'to_json', None):
         return obj.to_json()
-    if isinstance(obj, set):
+    if isinstance(obj, (set, frozenset)):
         return list(obj)
     raise TypeError(f'unexpected {obj}')
@@ -3,24 +3,29 @@ Graph structures and algorithms.
 """
 
 from typing import Optional, Callable
-import io
+from collections.abc import Collection, Iterable, Mapping
+import heapq
 import logging
+import sys
 
 
 logger = logging.getLogger(__name__)
 
 
 class DepGraphNode:
-    __slots__ = ("name", "in_refs", "out_refs", "data")
+    __slots__ = ("name", "in_refs", "out_refs", "shape", "color")
     in_refs: set['DepGraphNode']
     out_refs: set['DepGraphNode']
-    data: dict[str, object]
+    # DOT rendering attributes
+    shape: Optional[str]
+    color: Optional[str]
 
     def __init__(self, name: str):
-        self.name = name
+        self.name = sys.intern(name)
         self.in_refs = set()
         self.out_refs = set()
-        self.data = {}
+        self.shape = None
+        self.color = None
 
     @property
     def is_root(self):
@@ -50,30 +55,38 @@ class DepGraphNode:
 
 
 class DepGraph:
-    __slots__ = ("_nodes")
+    __slots__ = ("_nodes", "_keys")
     _nodes: dict[str, DepGraphNode]
+    # built on first access, reset when nodes are added or removed
+    _keys: Optional[frozenset[str]]
 
     def __init__(self):
         self._nodes = {}
+        self._keys = None
 
     @property
     def keys(self) -> frozenset[str]:
-        return frozenset(self._nodes.keys())
+        if self._keys is None:
+            self._keys = frozenset(self._nodes.keys())
+        return self._keys
     
     @property
     def nodes(self) -> list[DepGraphNode]:
         return list(self._nodes.values())
     
     def get_node(self, lib: str):
-        node = self._nodes.get(lib, None)
-        if not node:
+        try:
+            return self._nodes[lib]
+        except KeyError:
             node = DepGraphNode(lib)
             self._nodes[lib] = node
-        return node
+            self._keys = None
+            return node
     
     def remove_node(self, name: str):
         node = self._nodes.pop(name, None)
         if node:
+            self._keys = None
             for child in list(node.out_refs):
                 child.remove_in_ref(node)
             for parent in list(node.in_refs):
@@ -85,6 +98,16 @@ class DepGraph:
         src_node.out_refs.add(tgt_node)
         tgt_node.in_refs.add(src_node)
 
+    def add_dependencies(self, dependencies: Iterable[tuple[str, str]]):
+        """Adds many (src, tgt) dependencies, looking up each source node once per run"""
+        src_node = None
+        for src, tgt in dependencies:
+            if src_node is None or src_node.name != src:
+                src_node = self.get_node(src)
+            tgt_node = self.get_node(tgt)
+            src_node.out_refs.add(tgt_node)
+            tgt_node.in_refs.add(src_node)
+
     def remove_dependency(self, src: str, tgt: str):
         src_node = self.get_node(src)
         tgt_node = self.get_node(tgt)
@@ -94,90 +117,121 @@ class DepGraph:
     def traverse(self, node_visitor: Callable[[DepGraphNode], None],
                  arc_visitor: Optional[Callable[[DepGraphNode, DepGraphNode], None]] = None):
         logger.debug('traversing graph')
-        roots = [n for n in self.nodes if n.is_root]
+        # nodes are visited level by level, in alphabetical order within each level;
+        # names are unique, so heap entries never compare the nodes themselves
+        heap = [(0, n.name, n) for n in self._nodes.values() if n.is_root]
+        heapq.heapify(heap)
         visit_count: dict[str, int] = {}
 
-        while len(roots) > 0:
-            roots.sort(key=lambda n : n.name)
-            next_roots = []
-            for node in roots:
-                logger.debug('processing node %s', node)
-                node_visitor(node)
-                node_children: set[DepGraphNode] = node.out_refs.copy()
-                for target in node_children:
-                    num_visits = visit_count.get(target.name, 0) + 1
-                    visit_count[target.name] = num_visits
-                    if arc_visitor:
-                        arc_visitor(node, target)
-                    if num_visits == target.in_degree:
-                        next_roots.append(target)
-            roots = next_roots
+        while heap:
+            level, _, node = heapq.heappop(heap)
+            logger.debug('processing node %s', node)
+            node_visitor(node)
+            # the visitors must not change the arcs of the visited node
+            for target in node.out_refs:
+                num_visits = visit_count.get(target.name, 0) + 1
+                visit_count[target.name] = num_visits
+                if arc_visitor:
+                    arc_visitor(node, target)
+                if num_visits == target.in_degree:
+                    heapq.heappush(heap, (level + 1, target.name, target))
 
     def __repr__(self):
-        return f"DepGraph[{str(list(self.nodes.values()))}]"
+        return f"DepGraph[{str(self.nodes)}]"
     
     def to_dot(self):
         """
         Creates a DOT description of the graph
         """
-        text = io.StringIO()
-        text.write('digraph {\n')
-        for node in self.nodes:
-            if len(node.data) > 0:
+        lines = ['digraph {\n']
+        nodes = self._nodes.values()
+        for node in nodes:
+            if node.shape or node.color:
                 format = []
-                if (shape := node.data.get('shape', None)):
-                    format.append(f'shape={shape}')
-                if (color := node.data.get('color', None)):
-                    format.extend(['style=filled', f'fillcolor="{color}"'])
+                if node.shape:
+                    format.append(f'shape={node.shape}')
+                if node.color:
+                    format.extend(['style=filled', f'fillcolor="{node.color}"'])
                 format = ', '.join(format)
-                text.write(f'  "{node.name}" [{format}];\n')
-        for node in self.nodes:
-            for child in node.out_refs:
-                text.write(f'  "{node.name}" -> "{child.name}";\n')
-        text.write('}\n')
-        return text.getvalue()
+                lines.append(f'  "{node.name}" [{format}];\n')
+        for node in nodes:
+            lines.extend(f'  "{node.name}" -> "{child.name}";\n' for child in node.out_refs)
+        lines.append('}\n')
+        return ''.join(lines)
 
 
 def sort_graph(graph: DepGraph):
+    # Kahn's algorithm on plain name lists is faster than a traverse with a visitor
+    return sort_dependencies({node.name: node.out_ids for node in graph._nodes.values()})
+
+
+def sort_dependencies(dependencies: Mapping[str, Collection[str]]):
+    """
+    Sorts the nodes of a graph described by an adjacency map, without building a DepGraph.
+    The order is the same as sort_graph: level by level, alphabetically within a level.
+    """
+    in_degree = dict.fromkeys(dependencies, 0)
+    for targets in dependencies.values():
+        for tgt in targets:
+            in_degree[tgt] = in_degree.get(tgt, 0) + 1
+
     sorted_names = []
-    graph.traverse(lambda node: sorted_names.append(node.name))
+    roots = [name for name, degree in in_degree.items() if degree == 0]
+    while len(roots) > 0:
+        roots.sort()
+        sorted_names.extend(roots)
+        next_roots = []
+        for name in roots:
+            for tgt in dependencies.get(name, ()):
+                in_degree[tgt] -= 1
+                if in_degree[tgt] == 0:
+                    next_roots.append(tgt)
+        roots = next_roots
     return sorted_names
 
 
-def prune_arcs(graph: DepGraph):
+def prune_arcs(graph: DepGraph, *, in_place=False):
+    """
+    Returns a copy of the graph without the arcs implied by other paths (transitive reduction).
+    With in_place the arcs are removed from the graph itself, which is returned.
+    """
     logger.debug('pruning graph')
-    pruned = DepGraph()
+    pruned = graph if in_place else DepGraph()
+    if not in_place:
+        for node in graph.nodes:
+            pruned.get_node(node.name)
+    # strict ancestors of each node as a bitset over the visit order,
+    # built in topological order from those of its parents
+    bits: dict[str, int] = {}
+    ancestors: dict[str, int] = {}
 
-    nodes_with_multiple_dependants: list[DepGraphNode] = []
-    
     def node_visitor(node: DepGraphNode):
-        new_node = pruned.get_node(node.name)
-        if node.in_degree > 1:
-            nodes_with_multiple_dependants.append(new_node)
-
-    def arc_visitor(src: DepGraphNode, tgt: DepGraphNode):
-        pruned.add_dependency(src.name, tgt.name)
-
-    graph.traverse(node_visitor, arc_visitor)
-
-    def recursive_check(node: DepGraphNode, alternatives: set[DepGraphNode]):
-        to_be_removed: set[DepGraphNode] = set()
+        node_ancestors = 0
         for parent in node.in_refs:
-            if parent in alternatives:
-                alternatives.discard(parent)
-                to_be_removed.add(parent)
-            recursive_check(parent, alternatives)
-        return to_be_removed
-    
-    for node in nodes_with_multiple_dependants:
-        logger.debug(f'checking incoming arcs of node {node.name}')
-        to_be_pruned: set[DepGraphNode] = set()
-        for parent in node.in_refs:
-            res = recursive_check(parent, set(node.in_refs))
-            to_be_pruned.update(res)
-        logger.debug(f'removing parents {[n.name for n in to_be_pruned]}')
-        for parent in to_be_pruned:
-            node.remove_in_ref(parent)
+            node_ancestors |= bits[parent.name] | ancestors[parent.name]
+        bits[node.name] = 1 << len(bits)
+        ancestors[node.name] = node_ancestors
+
+    graph.traverse(node_visitor)
+
+    for node in graph.nodes:
+        parents = [parent.name for parent in node.in_refs]
+        redundant: set[str] = set()
+        # nodes on a cycle, or below one, are never visited: their arcs are kept as they are
+        if len(parents) > 1 and node.name in ancestors:
+            logger.debug(f'checking incoming arcs of node {node.name}')
+            # a parent is redundant if it is also an ancestor of another parent
+            parents_ancestors = 0
+            for parent in parents:
+                parents_ancestors |= ancestors[parent]
+            redundant = {parent for parent in parents if parents_ancestors & bits[parent]}
+            logger.debug(f'removing parents {list(redundant)}')
+        if in_place:
+            for parent in redundant:
+                graph.remove_dependency(parent, node.name)
+        else:
+            for parent in parents:
+                if parent not in redundant:
+                    pruned.add_dependency(parent, node.name)
 
     return pruned
-
@@ -1,18 +1,22 @@
 #!/usr/bin/env python3
 
+import os
 import sys
 from pathlib import Path
 import argparse
 import logging
 import fnmatch
-from collections.abc import Collection
+import re
+from collections import deque
+from collections.abc import Collection, Iterable
 
 from conan_barbarian.data import Cache, strip_library_name
-from conan_barbarian.graphs import DepGraph, DepGraphNode, prune_arcs, sort_graph
-from conan_barbarian.scraping import analyze_library
+from conan_barbarian.graphs import DepGraph, DepGraphNode, prune_arcs, sort_dependencies
 
 logger = logging.getLogger(__name__)
 
+LIBRARY_SUFFIXES = ('.a', '.so')
+
 
 def filter_libraries(cache: Cache, libs: list[str]):
     patched_names = []
@@ -25,77 +29,92 @@ def filter_libraries(cache: Cache, libs: list[str]):
     return patched_names
 
 
-def create_libs_graph(cache: Cache, roots: Collection[str]):
+def collect_dependencies(cache: Cache, roots: Collection[str]):
     """
-    Creates a graph with the input libraries and all their dependencies.
+    Maps the input libraries and all their dependencies to their direct dependencies.
     """
-    graph = DepGraph()
-    visited = set()
-    queue = list(roots)
-    while len(queue) > 0:
-        item = queue.pop()
+    dependencies: dict[str, Collection[str]] = {}
+    queue = deque(roots)
+    queued = set(roots)
+    while queue:
+        item = queue.popleft()
         if not cache.is_library(item):
             raise Exception(f"'{item} is not a library")
 
-        graph.get_node(item)
-        visited.add(item)
-        item_deps = cache.get_dependencies(item)
+        item_deps = cache.get_dependencies(item, shared=True)
+        dependencies[item] = item_deps
         for dep in item_deps:
-            graph.add_dependency(item, dep)
-            if not dep in queue and not dep in visited:
+            if dep not in queued:
+                queued.add(dep)
                 queue.append(dep)
+    return dependencies
+
+
+def create_libs_graph(cache: Cache, roots: Collection[str]):
+    """
+    Creates a graph with the input libraries and all their dependencies.
+    """
+    graph = DepGraph()
+    for item, item_deps in collect_dependencies(cache, roots).items():
+        graph.get_node(item)
+        graph.add_dependencies((item, dep) for dep in item_deps if dep != item)
     return graph
 
 
-def replace_libs_with_components(cache: Cache, graph: DepGraph):
-    for node in graph.nodes:
-        component = cache.get_library_component(node.name)
-        if component:
-            logger.debug(f"replacing '{node.name}' with '{component}'")
-            comp_node = graph.get_node(component)
-            for src in node.in_refs:
-                if src != comp_node:
-                    graph.add_dependency(src.name, component)
-            for tgt in node.out_refs:
-                if tgt != comp_node:
-                    graph.add_dependency(component, tgt.name)
-            graph.remove_node(node.name)
+def create_components_graph(cache: Cache, roots: Collection[str]):
+    """
+    Creates a graph with the input libraries and all their dependencies, where the libraries
+    belonging to a component are already replaced by the component.
+    """
+    # the same libraries are reached from many others, look each one up once
+    resolved: dict[str, str] = {}
+
+    def resolve(lib: str):
+        node = resolved.get(lib)
+        if node is None:
+            node = resolved[lib] = cache.get_library_component(lib) or lib
+        return node
+
+    graph = DepGraph()
+    for item, item_deps in collect_dependencies(cache, roots).items():
+        node = resolve(item)
+        graph.get_node(node)
+        for dep in item_deps:
+            dep_node = resolve(dep)
+            if dep_node != node:
+                graph.add_dependency(node, dep_node)
+    return graph
 
 
 def sort_by_dependency(cache: Cache, libs: Collection[str], add_dependencies=False):
-    graph = create_libs_graph(cache, libs)
-    sorted_dependencies = sort_graph(graph)
+    sorted_dependencies = sort_dependencies(collect_dependencies(cache, libs))
     if not add_dependencies:
+        if not isinstance(libs, (set, frozenset)):
+            libs = frozenset(libs)
         return [lib for lib in sorted_dependencies if lib in libs]
     return sorted_dependencies
 
 
-def quote_lib_name(name: str, args: argparse.Namespace):
-    if args.quote:
-        return args.quote + name + args.quote
-    return name
+def format_lib(name: str, args: argparse.Namespace):
+    short = args.names == 'short'
+    quote = args.quote
 
+    def format_one(lib: str):
+        if short:
+            lib = strip_library_name(lib)
+        return quote + lib + quote if quote else lib
 
-def format_lib(name: str, args: argparse.Namespace):
-    if isinstance(name, (list, set)):
-        return [format_lib(x, args) for x in name]
-    
-    mode = args.names
-    if mode == 'short':
-        name = strip_library_name(name)
-    return quote_lib_name(name, args)
+    if isinstance(name, (list, set, frozenset, tuple)):
+        return [format_one(x) for x in name]
+    return format_one(name)
 
 
-def minimize_dependencies_list(cache: Cache, libs: list[str]):
-    result = libs.copy()
+def minimize_dependencies_list(cache: Cache, libs: Collection[str]):
+    get_dependencies = cache.get_dependencies
+    indirect = set()
     for lib in libs:
-        deps = cache.get_dependencies(lib)
-        for d in deps:
-            try:
-                result.remove(d)
-            except (ValueError, KeyError):
-                pass
-    return result
+        indirect.update(get_dependencies(lib, shared=True))
+    return [lib for lib in libs if lib not in indirect]
 
 
 def print_component_cpp_info(component: str,
@@ -103,17 +122,23 @@ def print_component_cpp_info(component: str,
                              dependencies: Collection[str], 
                              system_libs: Collection[str],
                              *, indent='\t'):
-    lib_names = ', '.join([f'"{strip_library_name(l)}"' for l in libs])
-    print(f'{indent}{indent}self.cpp_info.components["{component}"].libs = [{lib_names}]')
+    prefix = indent * 2
+    dep_prefix = indent * 3
+    field_line = prefix + 'self.cpp_info.components["%s"].%s = [%s]'
+    lines = []
+    lib_names = ', '.join(f'"{strip_library_name(l)}"' for l in libs)
+    lines.append(field_line % (component, 'libs', lib_names))
     if system_libs:
-        system_lib_names = ', '.join([f'"{strip_library_name(l)}"' for l in system_libs])
-        print(f'{indent}{indent}self.cpp_info.components["{component}"].system_libs = [{system_lib_names}]')
+        system_lib_names = ', '.join(f'"{strip_library_name(l)}"' for l in system_libs)
+        lines.append(field_line % (component, 'system_libs', system_lib_names))
     if len(dependencies) > 0:
-        print(f'{indent}{indent}self.cpp_info.components["{component}"].requires.extend([')
+        lines.append(prefix + 'self.cpp_info.components["%s"].requires.extend([' % component)
         for dep in dependencies:
-            print(f'{indent}{indent}{indent}"{dep}",')
-        print(f'{indent}{indent}])')
-    print()
+            lines.append(f'{dep_prefix}"{dep}",')
+        lines.append(prefix + '])')
+    # the whole block is written at once
+    lines.append('\n')
+    sys.stdout.write('\n'.join(lines))
 
 
 def expand_args_to_libraries(cache: Cache, items: list[str]):
@@ -140,11 +165,9 @@ class PackagePrinter:
 
 def generate_conan_package_info_function(cache: Cache, items: list[str], minimize: bool, indentation: str):
     libraries = expand_args_to_libraries(cache, items)
-    graph = create_libs_graph(cache, libraries)
-
-    replace_libs_with_components(cache, graph)
+    graph = create_components_graph(cache, libraries)
     if minimize:
-        graph = prune_arcs(graph)
+        prune_arcs(graph, in_place=True)
 
     def patch_lib_name(name):
         stripped = strip_library_name(name)
@@ -152,20 +175,25 @@ def generate_conan_package_info_function(cache: Cache, items: list[str], minimiz
             return f'_{stripped}'
         return stripped
 
+    patched_names = {node.name: patch_lib_name(node.name) for node in graph.nodes}
+    system_names = frozenset(name for name in patched_names.values()
+                             if (lib := cache.get_library(name)) is not None and lib.system)
+
     def node_visitor(node: DepGraphNode):
         if cache.is_component(node.name):
             libs = sort_by_dependency(cache, cache.get_component_libraries(node.name))
-            deps = {patch_lib_name(lib_node.name) for lib_node in node.out_refs}
+            deps = {patched_names[lib_node.name] for lib_node in node.out_refs}
             deps = deps.difference(libs)
-            system_libs = cache.filter_system_libraries(deps, True)
-            deps = cache.filter_system_libraries(deps, False)
+            system_libs = deps & system_names
+            deps -= system_names
             print_component_cpp_info(node.name, libs, deps, system_libs, indent=indentation)
-        elif not cache.get_library(node.name).system:
-            lib = cache.get_library(node.name)
-            component_name = patch_lib_name(lib.name)
-            deps = {patch_lib_name(out.name) for out in node.out_refs}
-            system_libs = cache.filter_system_libraries(deps, True)
-            deps = cache.filter_system_libraries(deps, False)
+            return
+        lib = cache.get_library(node.name)
+        if not lib.system:
+            component_name = patched_names[node.name]
+            deps = {patched_names[out.name] for out in node.out_refs}
+            system_libs = deps & system_names
+            deps -= system_names
             logger.debug('comp %s deps %s sys %s', component_name, ','.join(deps), ','.join(system_libs))
             print_component_cpp_info(component_name, [lib.name], deps, system_libs, indent=indentation)
 
@@ -175,31 +203,66 @@ def generate_conan_package_info_function(cache: Cache, items: list[str], minimiz
     graph.traverse(node_visitor)
 
 
+def iter_library_files(root: Path):
+    """
+    Recursively yields the static and dynamic libraries in a folder
+    """
+    folders = [os.fspath(root)]
+    while folders:
+        try:
+            entries = os.scandir(folders.pop())
+        except PermissionError:
+            # unreadable folders are skipped, like Path.rglob does
+            continue
+        with entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    folders.append(entry.path)
+                elif entry.name.endswith(LIBRARY_SUFFIXES):
+                    yield Path(entry.path)
+
+
 ###############################################################################
 #  CLI Commands
 ###############################################################################
 
 
 def cmd_analyze_libs(cache: Cache, args: argparse.Namespace):
+    # only this command runs nm, the other ones should not pay for these imports
+    from concurrent.futures import ProcessPoolExecutor
+    from conan_barbarian.scraping import scan_library, add_library_symbols
 
-    def check_and_analyze(lib: Path, cache: Cache, args: argparse.Namespace):
+    to_analyze: dict[str, Path] = {}
+
+    def check_and_add(lib: Path, cache: Cache, args: argparse.Namespace):
         lib_name = lib.name
-        if cache.is_library(lib_name):
+        if cache.is_library(lib_name) or strip_library_name(lib_name) in to_analyze:
             if args.force:
                 cache.remove_library(lib_name)
             else:
                 return
-        print(f'analyzing {lib}')
-        analyze_library(lib, cache, package=args.package, system=args.system)
+        to_analyze[strip_library_name(lib_name)] = lib
 
     for lib in args.libs:
         path = Path(lib)
-        if path.resolve().is_file():
-            check_and_analyze(path, cache, args)
+        if path.is_file():
+            check_and_add(path, cache, args)
         elif path.is_dir():
-            for child in path.glob(r'**/*'):
-                if child.suffix in ['.a', '.so']:
-                    check_and_analyze(child, cache, args)
+            for child in iter_library_files(path):
+                check_and_add(child, cache, args)
+
+    def merge_results(paths: list[Path], results: Iterable[tuple[list[str], list[str]]]):
+        # the cache is updated sequentially, in the same order the libraries were found
+        for lib, (defined, undefined) in zip(paths, results):
+            print(f'analyzing {lib}')
+            add_library_symbols(cache, lib, defined, undefined, package=args.package, system=args.system)
+
+    paths = list(to_analyze.values())
+    if args.jobs == 1 or len(paths) < 2:
+        merge_results(paths, map(scan_library, paths))
+    else:
+        with ProcessPoolExecutor(max_workers=args.jobs) as executor:
+            merge_results(paths, executor.map(scan_library, paths))
     cache.save()
 
 
@@ -228,7 +291,7 @@ def cmd_find_dependencies(cache: Cache, args: argparse.Namespace):
             print(f"- {lib}: <not found>")
             continue
 
-        deps = cache.get_dependencies(lib_name)
+        deps = cache.get_dependencies(lib_name, shared=True)
         if args.minimize:
             deps = minimize_dependencies_list(cache, deps)
         elif args.recursive:
@@ -243,9 +306,7 @@ def cmd_find_dependencies(cache: Cache, args: argparse.Namespace):
 
 
 def cmd_print_cpp_info(cache: Cache, args: argparse.Namespace):
-    indentation = '\t'
-    if args.indent > 0:
-        indentation = ''.join([' ' for x in range(args.indent)])
+    indentation = ' ' * args.indent if args.indent > 0 else '\t'
 
     return generate_conan_package_info_function(cache, args.items, args.minimize, indentation)
 
@@ -255,26 +316,25 @@ def cmd_define_component(cache: Cache, args: argparse.Namespace):
     current_libraries = cache.get_component_libraries(component)
     logger.debug('old libraries in component %s: %s', component, current_libraries)
 
-    libs = []
-    all_libs = cache.all_library_files()
-    for lib in args.libs:
-        new_libs = fnmatch.filter(all_libs, lib)
-        libs.extend(new_libs)
+    # a single regex matching any of the globs, to scan the libraries once
+    matcher = re.compile('|'.join(fnmatch.translate(lib) for lib in args.libs))
+    libs = [lib for lib in cache.all_library_files() if matcher.match(lib)]
     cache.set_component_libraries(component, libs)
 
     cache.save()
 
 
 def cmd_print_graph(cache: Cache, args: argparse.Namespace):
-    graph = create_libs_graph(cache, args.libs)
     if args.show_components:
-        replace_libs_with_components(cache, graph)
+        graph = create_components_graph(cache, args.libs)
+    else:
+        graph = create_libs_graph(cache, args.libs)
     for node in graph.nodes:
         if cache.is_component(node.name):
-            node.data['shape'] = 'component'
-            node.data['color'] = '#cbffc0'
+            node.shape = 'component'
+            node.color = '#cbffc0'
         elif (lib := cache.get_library(node.name)) and lib.system:
-            node.data['color'] = '#c5c0ff'
+            node.color = '#c5c0ff'
     print(graph.to_dot())
 
 
@@ -294,6 +354,7 @@ def configure_logging(args: argparse.Namespace):
 def main_cli():
     parser = argparse.ArgumentParser()
     parser.add_argument('project', help='project_file')
+    parser.add_argument('--pretty', action='store_true', help='save the project file as indented JSON')
     subparsers = parser.add_subparsers(title='commands', description='The following commands are available:', required=True)
 
     print_args = argparse.ArgumentParser(add_help=False)
@@ -307,6 +368,8 @@ def main_cli():
     parser_analyze.add_argument('--system', action='store_true')
     parser_analyze.add_argument('--force', action='store_true', help='reanalyze existing libraries')
     parser_analyze.add_argument('--package', help='add the libraries to a logical package')
+    parser_analyze.add_argument('-j', '--jobs', type=int, default=None,
+                                help='number of libraries analyzed in parallel, by default the number of CPUs')
     parser_analyze.set_defaults(func=cmd_analyze_libs)
 
     parser_sort = subparsers.add_parser('sort', parents=[print_args],
@@ -341,7 +404,7 @@ def main_cli():
     graph.add_argument('--show-components', action='store_true')
     graph.set_defaults(func=cmd_print_graph)
 
-    cpp_info = subparsers.add_parser('cppinfo', help="generates a conan package_info function")
+    cpp_info = subparsers.add_parser('cppinfo', parents=[print_args], help="generates a conan package_info function")
     cpp_info.add_argument('items', nargs='+', help="top libraries to be included, along with their dependencies")
     cpp_info.add_argument('--minimize', action='store_true', help="reduces the number of direct dependencies, removing those already required indirectly")
     cpp_info.add_argument('--indent', default=0, type=int, help="number of spaces to be used for intendation, by default tabs are used")
@@ -351,7 +414,7 @@ def main_cli():
 
     configure_logging(args)
 
-    cache = Cache(Path(args.project))
+    cache = Cache(Path(args.project), pretty=args.pretty)
     cache.load()
     args.func(cache, args)
 
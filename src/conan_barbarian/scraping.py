@@ -3,17 +3,18 @@ Functions to analyze static and dynamic libraries and extract the symbols they d
 """
 
 from pathlib import Path
+import os
 import re
 import subprocess
+import sys
 import logging
+from typing import Union
+from collections.abc import Iterable
 from conan_barbarian.data import Cache
 
 
 logger = logging.getLogger(__name__)
 
-NM_REGEX = re.compile(r'^(?:[0-9a-f]{16})?\s+(?P<type>[AcBbCcDdGgRrSsTtUuVvWw])\s+(?P<symbol>.*)$')
-GLIB_REGEX = re.compile(r'@+.*$')
-
 
 def _file_is_dynamic_library(path: Path):
     with path.open('rb') as f:
@@ -21,44 +22,70 @@ def _file_is_dynamic_library(path: Path):
         return head == b'\x7fELF'
 
 
-def _parse_nm_output(nm_output: str):
+# '[address] type symbol', where versioned symbols (e.g. func@@GLIB) are cut at the '@'
+# (T)text, (R)read-only, (W)weak, (B)bss area, (D)data are defined, (U) is undefined
+NM_SYMBOL_REGEX = re.compile(rb'^[0-9a-fA-F ]+ ([TRWBDU]) ([^@\r\n]+)', re.MULTILINE)
+NM_READ_SIZE = 1 << 20
+# nm options by library suffix, dynamic libraries export their symbols in the dynamic table
+NM_OPTIONS = {
+    '.a': (),
+    '.so': ('-D',),
+}
+# linker scripts: comments, lazily linked libraries and the libraries to link
+LD_COMMENT_REGEX = re.compile(r'/\*.*?\*/', re.DOTALL)
+LD_AS_NEEDED_REGEX = re.compile(r'AS_NEEDED\s*\([^)]*\)')
+LD_INPUT_REGEX = re.compile(r'\b(?:GROUP|INPUT)\s*\(([^)]*)\)')
+
+
+def _parse_nm_output(nm_output: Union[bytes, str, Iterable[bytes]]):
+    """
+    Splits nm output lines, formatted as '[address] type symbol', into defined and undefined symbols.
+    The output can be passed as a whole or as an iterable of blocks of whole lines (e.g. from a pipe).
+    """
+    if isinstance(nm_output, str):
+        nm_output = nm_output.encode()
+    if isinstance(nm_output, bytes):
+        nm_output = (nm_output,)
     defined_symbols = []
     undefined_symbols = []
-    for line in nm_output.splitlines():
-        if (match := NM_REGEX.match(line)):
-            stype, symbol = match.groups()
-            # we just ignore versioned symbols (e.g. func@@GLIB)
-            symbol = GLIB_REGEX.sub('', symbol)
-            # (T)text, (R)read-only, (W)weak, (B)bss area
-            if stype in ['T', 'R', 'W', 'B', 'D']:
-                defined_symbols.append(symbol)
-            elif stype == 'U':  # (U)undefined
-                undefined_symbols.append(symbol)
-    undefined_symbols = [us for us in undefined_symbols if us not in defined_symbols]
+    for block in nm_output:
+        for stype, symbol in NM_SYMBOL_REGEX.findall(block):
+            if stype == b'U':
+                undefined_symbols.append(symbol.decode())
+            else:
+                defined_symbols.append(symbol.decode())
+    defined_set = set(defined_symbols)
+    undefined_symbols = [us for us in undefined_symbols if us not in defined_set]
     return defined_symbols, undefined_symbols
 
 
+def _read_line_blocks(stream, size=NM_READ_SIZE):
+    """
+    Reads a binary stream in large blocks, each one ending at a line boundary.
+    """
+    remainder = b''
+    while (data := stream.read(size)):
+        data = remainder + data
+        end = data.rfind(b'\n') + 1
+        remainder = data[end:]
+        if end:
+            yield data[:end]
+    if remainder:
+        yield remainder
+
+
 def _parse_link_script(path: Path):
     """
     Parses a linker script, that can be used at build time instead of a real library (.so)
     """
     logger.info('Parsing script %s', path)
+    # a comment separates tokens like a blank does
+    script = LD_COMMENT_REGEX.sub(' ', path.read_text())
+    # remove AS_NEEDED libs for now
+    script = LD_AS_NEEDED_REGEX.sub('', script)
     libs: list[str] = []
-    with path.open() as f:
-        lines = f.readlines()
-    in_comment = False
-    for line in lines:
-        if '/*' in line:
-            line = re.sub(r'/\*.*$', '', line)
-            in_comment = True
-        elif in_comment:
-            in_comment = not '*/' in line
-            line = re.sub(r'^.*(\*/)?', '', line)
-        
-        # remove AS_NEEDED libs for now
-        line = re.sub(r'AS_NEEDED\s*\([^)]*\)', '', line)
-        if (match := re.match(r'(GROUP|INPUT)\s*\(([^)]*)\)', line)):
-            libs.extend(match.group(2).split())
+    for group in LD_INPUT_REGEX.findall(script):
+        libs.extend(group.split())
     logger.debug('script %s links libraries %s', path, ','.join(libs))
     return libs
 
@@ -66,33 +93,46 @@ def _parse_link_script(path: Path):
 def _update_cache(cache: Cache, libname: str, defined: list[str], undefined: list[str], *, package=None, system=False):
     cache.add_library(libname, package=package, system=system)
 
-    for symbol in defined:
-        depending_libs = cache.define_symbol(symbol, libname)
-        for dl in depending_libs:
-            cache.add_dependency(dl, libname)
+    if defined:
+        # many symbols link the same pair of libraries, add each dependency once
+        depending_libs = cache.define_symbols(defined, libname)
+        cache.add_dependencies((dl, libname) for dl in depending_libs)
+    if not undefined:
+        return
 
+    get_definer = cache.get_library_defining_symbol
+    definers = set()
+    still_undefined = []
     for symbol in undefined:
-        definer = cache.get_library_defining_symbol(symbol)
+        definer = get_definer(symbol)
         if definer:
-            cache.add_dependency(libname, definer)
+            definers.add(definer)
         else:
-            cache.add_undefined_symbol_dependency(symbol, libname)
+            # the same external symbols are needed by many libraries, share one string
+            still_undefined.append(sys.intern(symbol))
+    if still_undefined:
+        cache.add_undefined_symbols_dependency(still_undefined, libname)
+    cache.add_dependencies((libname, definer) for definer in definers)
 
 
 def _search_symbols_in_library(path: Path):
     suffix = path.suffixes[0] if len(path.suffixes) > 0 else ''
-    if suffix == '.a':
-        cmd = ['nm', '-C', str(path)]
-    elif suffix == '.so':
-        cmd = ['nm', '-C', '-D', str(path)]
-    else:
+    options = NM_OPTIONS.get(suffix)
+    if options is None:
         raise Exception(f'Invalid library path {path}')
+    path_name = os.fspath(path)
+    cmd = ['nm', '-C', *options, path_name]
 
-    cp = subprocess.run(cmd, capture_output=True, text=True)
-    return _parse_nm_output(cp.stdout)   
+    # parse the output while nm is still running
+    with subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL) as proc:
+        return _parse_nm_output(_read_line_blocks(proc.stdout))
 
 
-def analyze_library(library_path: Path, cache: Cache, *, package=None, system=False):
+def scan_library(library_path: Path):
+    """
+    Returns the symbols defined and needed by a library, without touching the cache.
+    It is safe to run in a worker process.
+    """
     suffix = library_path.suffixes[0] if len(library_path.suffixes) > 0 else ''
     if suffix == '.so' and not _file_is_dynamic_library(library_path):
         defined, undefined = [], []
@@ -103,6 +143,15 @@ def analyze_library(library_path: Path, cache: Cache, *, package=None, system=Fa
             undefined.extend(lib_need)
     else:
         defined, undefined = _search_symbols_in_library(library_path)
-    
-    libname = library_path.name
-    _update_cache(cache, libname, defined, undefined, package=package, system=system)
+    return defined, undefined
+
+
+def analyze_library(library_path: Path, cache: Cache, *, package=None, system=False):
+    defined, undefined = scan_library(library_path)
+    add_library_symbols(cache, library_path, defined, undefined, package=package, system=system)
+
+
+def add_library_symbols(cache: Cache, library_path: Path, defined: list[str], undefined: list[str], *,
+                        package=None, system=False):
+    """Adds to the cache a library scanned with scan_library"""
+    _update_cache(cache, library_path.name, defined, undefined, package=package, system=system)
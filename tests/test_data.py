@@ -1,6 +1,7 @@
-from conan_barbarian.data import Library, Cache
+from conan_barbarian.data import Library, Cache, json_encoder
 import pytest
 from pathlib import Path
+import json
 
 
 def all_lib_names(cache: Cache):
@@ -93,6 +94,17 @@ def test_get_library():
     assert cache.get_library('potato') is None
 
 
+def test_replacing_library_with_same_name():
+    cache = Cache()
+    cache.add_library('libmath.a')
+    cache.add_library('libmath.so')
+
+    assert cache.get_library('libmath.a') is None
+    assert cache.find_library('libmath.so') == 'libmath.so'
+    assert cache.find_library('math') == 'libmath.so'
+    assert cache.all_library_files() == ['libmath.so']
+
+
 def test_add_dependencies():
     cache = Cache()
     cache.add_library('libfoo.so')
@@ -116,6 +128,21 @@ def test_add_dependencies_with_filename():
     assert deps == {'libbar.a', 'libquz.so'}
 
 
+def test_add_many_dependencies():
+    cache = Cache()
+    cache.add_library('libfoo.so')
+    cache.add_library('libbar.a')
+    cache.add_library('libquz.so')
+    assert cache.get_dependencies('foo', transitive=True) == set()
+    cache.add_dependencies([('libfoo.so', 'libbar.a'), ('foo', 'libquz.so'), ('libbar.a', 'libquz.so'),
+                            ('libquz.so', 'libquz.so')])
+
+    assert cache.get_dependencies('foo') == {'libbar.a', 'libquz.so'}
+    assert cache.get_dependencies('bar') == {'libquz.so'}
+    assert cache.get_dependencies('quz') == set()
+    assert cache.get_dependencies('foo', transitive=True) == {'libbar.a', 'libquz.so'}
+
+
 def test_transitive_dependencies():
     cache = Cache()
     cache.add_library('libfoo.so')
@@ -134,6 +161,41 @@ def test_transitive_dependencies():
     assert cache.get_library('bar').dependencies == {'libquz.so'}
 
 
+def test_transitive_dependencies_updated_after_changes():
+    cache = Cache()
+    cache.add_library('libfoo.so')
+    cache.add_library('libbar.a')
+    cache.add_library('libquz.so')
+    cache.add_dependency('libfoo.so', 'libbar.a')
+
+    assert cache.get_dependencies('bar', transitive=True) == set()
+    assert cache.get_dependencies('foo', transitive=True) == {'libbar.a'}
+
+    cache.add_dependency('libbar.a', 'libquz.so')
+    assert cache.get_dependencies('foo', transitive=True) == {'libbar.a', 'libquz.so'}
+
+    # returned sets can be modified without affecting the cache
+    cache.get_dependencies('foo', transitive=True).clear()
+    assert cache.get_dependencies('foo', transitive=True) == {'libbar.a', 'libquz.so'}
+
+
+def test_shared_dependencies():
+    cache = Cache()
+    cache.add_library('libfoo.so')
+    cache.add_library('libbar.a')
+    cache.add_library('libquz.so')
+    cache.add_dependency('libfoo.so', 'libbar.a')
+    cache.add_dependency('libbar.a', 'libquz.so')
+
+    deps = cache.get_dependencies('foo', shared=True)
+    assert isinstance(deps, frozenset)
+    assert deps == {'libbar.a'}
+    closure = cache.get_dependencies('foo', transitive=True, shared=True)
+    assert isinstance(closure, frozenset)
+    assert closure is cache.get_dependencies('foo', transitive=True, shared=True)
+    assert closure == {'libbar.a', 'libquz.so'}
+
+
 def test_dependencies_of_invalid_name_throws():
     cache = Cache()
     cache.add_library('libfoo.a')
@@ -199,6 +261,51 @@ def test_components():
     assert cache.get_library_component('libwolf.so') == 'c1'
     assert cache.get_library_component('librabbit.so') is None
 
+    cache.set_component_libraries('c1', ['libbird.so'])
+    cache.set_component_libraries('c2', ['libwolf.so'])
+    assert cache.get_library_component('libbird.so') == 'c1'
+    assert cache.get_library_component('libwolf.so') == 'c2'
+
+
+def test_components_moving_library():
+    cache = Cache()
+    for lib in ['libbird.so', 'libwolf.so']:
+        cache.add_library(lib)
+    cache.set_component_libraries('c1', ['libbird.so', 'libwolf.so'])
+    cache.set_component_libraries('c2', ['libwolf.so'])
+    cache.set_component_libraries('c1', ['libbird.so'])
+
+    assert cache.get_library_component('libbird.so') == 'c1'
+    assert cache.get_library_component('libwolf.so') == 'c2'
+
+
+def test_loaded_cache_to_json(tmp_path):
+    data_path = Path(tmp_path, 'cache.data')
+    cache = Cache(data_path)
+    cache.add_library('libcoffee.so')
+    cache.add_library('libsugar.so')
+    cache.add_dependency('libcoffee.so', 'libsugar.so')
+    cache.add_dependency('libcoffee.so', 'libmilk.so')
+    cache.save()
+
+    cache2 = Cache(data_path)
+    cache2.load()
+    data = json.loads(json.dumps(cache2, default=json_encoder))
+    coffee = next(lib for lib in data['libraries'] if lib['file'] == 'libcoffee.so')
+    assert coffee['needs'] == ['libmilk.so', 'libsugar.so']
+
+
+def test_components_io(tmp_path):
+    data_path = Path(tmp_path, 'cache.data')
+    cache = Cache(data_path)
+    cache.add_library('libbird.so')
+    cache.set_component_libraries('c1', ['libbird.so'])
+    cache.save()
+
+    cache2 = Cache(data_path)
+    cache2.load()
+    assert cache2.get_library_component('libbird.so') == 'c1'
+
 
 ### Symbols Management
 
@@ -223,6 +330,36 @@ def test_symbols_definition_with_depending_libs():
     assert depending_libs == {'libchase.a'}
 
 
+def test_bulk_symbols_definition():
+    cache = Cache()
+    cache.add_library('libchase.a')
+    cache.add_library('librun.a')
+    cache.add_undefined_symbol_dependency('dream::catchIt()', 'libchase.a')
+    cache.add_undefined_symbol_dependency('dream::wake()', 'librun.a')
+    cache.add_undefined_symbol_dependency('printf', 'librun.a')
+    cache.add_library('libdream.so')
+    depending_libs = cache.define_symbols(['dream::catchIt()', 'dream::wake()', 'dream::sleep()'], 'libdream.so')
+
+    assert depending_libs == {'libchase.a', 'librun.a'}
+    assert cache.get_library_defining_symbol('dream::sleep()') == 'libdream.so'
+    assert set(cache.undefined_symbols) == {'printf'}
+    cache.remove_library('libdream.so')
+    assert len(cache.defined_symbols) == 0
+
+
+def test_bulk_undefined_symbols():
+    cache = Cache()
+    cache.add_library('libdance.a')
+    cache.add_library('libsing.a')
+    cache.add_undefined_symbol_dependency('printf', 'libsing.a')
+    cache.add_undefined_symbols_dependency(['printf', 'malloc'], 'libdance.a')
+
+    assert cache.libraries_needing_undefined_symbol('printf') == {'libdance.a', 'libsing.a'}
+    assert cache.libraries_needing_undefined_symbol('malloc') == {'libdance.a'}
+    cache.remove_library('libdance.a')
+    assert set(cache.undefined_symbols) == {'printf'}
+
+
 def test_find_undefined_symbo():
     cache = Cache()
     cache.add_undefined_symbol_dependency('dance::foo_bar()', 'libdance.a')
@@ -250,3 +387,110 @@ def test_removing_libraries_and_symbols():
     assert set(cache.undefined_symbols) == { 'std::string', 'sing::belt()' }
     assert cache.libraries_needing_undefined_symbol('sing::belt()') == { 'librap.so' }
     assert cache.libraries_needing_undefined_symbol('std::string') == { 'librap.so' }
+
+
+def test_removing_libraries_and_symbols_after_load(tmp_path):
+    data_path = Path(tmp_path, 'cache.data')
+    cache = Cache(data_path)
+    cache.add_library('libdance.so')
+    cache.add_library('librap.so')
+    cache.define_symbol('rap::flow', 'librap.so')
+    cache.define_symbol('dance::jam()', 'libdance.so')
+    cache.add_undefined_symbol_dependency('sing::belt()', 'librap.so')
+    cache.add_undefined_symbol_dependency('sing::belt()', 'libdance.so')
+    cache.save()
+
+    cache2 = Cache(data_path)
+    cache2.load()
+    cache2.remove_library('libdance.so')
+    assert set(cache2.defined_symbols) == { 'rap::flow' }
+    assert cache2.libraries_needing_undefined_symbol('sing::belt()') == { 'librap.so' }
+
+
+def test_changes_after_load(tmp_path):
+    data_path = Path(tmp_path, 'cache.data')
+    cache = Cache(data_path)
+    cache.add_library('libdance.so')
+    cache.add_library('librap.so')
+    cache.add_library('libsing.so')
+    cache.add_dependency('librap.so', 'libdance.so')
+    cache.add_undefined_symbol_dependency('sing::belt()', 'librap.so')
+    cache.save()
+
+    cache2 = Cache(data_path)
+    cache2.load()
+    cache2.add_dependency('librap.so', 'libsing.so')
+    cache2.add_undefined_symbol_dependency('sing::belt()', 'libdance.so')
+    assert cache2.get_dependencies('rap') == {'libdance.so', 'libsing.so'}
+    assert cache2.libraries_needing_undefined_symbol('sing::belt()') == {'librap.so', 'libdance.so'}
+    assert cache2.define_symbol('sing::belt()', 'libsing.so') == {'librap.so', 'libdance.so'}
+
+
+def test_cache_io_binary(tmp_path):
+    pytest.importorskip('msgpack')
+    data_path = Path(tmp_path, 'cache.bin')
+
+    cache = Cache(data_path)
+    cache.add_library('libcoffee.so', package='drinks')
+    cache.add_library('libparty.a', system=True)
+    cache.add_dependency('party', 'libcoffee.so')
+    cache.define_symbol('coffee::brew()', 'libcoffee.so')
+    cache.add_undefined_symbol_dependency('sugar()', 'libcoffee.so')
+    cache.save()
+
+    with open(data_path, 'rb') as f:
+        assert f.read(1) != b'{'
+
+    cache2 = Cache(data_path)
+    cache2.load()
+    assert set(cache2.all_library_files()) == {'libcoffee.so', 'libparty.a'}
+    assert cache2.get_library('party').system
+    assert cache2.get_dependencies('party') == {'libcoffee.so'}
+    assert cache2.get_library_defining_symbol('coffee::brew()') == 'libcoffee.so'
+    assert cache2.libraries_needing_undefined_symbol('sugar()') == {'libcoffee.so'}
+    assert cache2.package_libraries('drinks') == ['coffee']
+
+
+def test_cache_io_json_with_binary_suffix(tmp_path):
+    data_path = Path(tmp_path, 'cache.bin')
+    data_path.write_text(json.dumps({
+        'libraries': [{'file': 'libcoffee.so', 'system': False, 'needs': ['libwater.so']},
+                      {'file': 'libwater.so', 'system': True, 'needs': []}],
+        'defined': {'coffee::brew()': 'libcoffee.so'},
+        'undefined': {},
+        'packages': {'drinks': ['libcoffee.so']},
+        'components': {},
+    }, indent=2))
+
+    cache = Cache(data_path)
+    cache.load()
+    assert set(cache.all_library_files()) == {'libcoffee.so', 'libwater.so'}
+    assert cache.get_dependencies('coffee') == {'libwater.so'}
+    assert cache.get_library_defining_symbol('coffee::brew()') == 'libcoffee.so'
+
+
+def test_cache_streaming_load(tmp_path, monkeypatch):
+    pytest.importorskip('ijson')
+    import conan_barbarian.data as data_module
+    monkeypatch.setattr(data_module, 'STREAMING_LOAD_SIZE', 0)
+
+    data_path = Path(tmp_path, 'cache.data')
+    cache = Cache(data_path)
+    cache.add_library('libcoffee.so', package='drinks')
+    cache.add_library('libparty.a', system=True)
+    cache.add_dependency('party', 'libcoffee.so')
+    cache.define_symbol('coffee::brew()', 'libcoffee.so')
+    cache.add_undefined_symbol_dependency('sugar()', 'libcoffee.so')
+    cache.add_undefined_symbol_dependency('sugar()', 'libparty.a')
+    cache.set_component_libraries('fun', ['libparty.a'])
+    cache.save()
+
+    cache2 = Cache(data_path)
+    cache2.load()
+    assert set(cache2.all_library_files()) == {'libcoffee.so', 'libparty.a'}
+    assert cache2.get_library('party').system
+    assert cache2.get_dependencies('party') == {'libcoffee.so'}
+    assert cache2.get_library_defining_symbol('coffee::brew()') == 'libcoffee.so'
+    assert cache2.libraries_needing_undefined_symbol('sugar()') == {'libcoffee.so', 'libparty.a'}
+    assert cache2.package_libraries('drinks') == ['coffee']
+    assert cache2.get_library_component('libparty.a') == 'fun'
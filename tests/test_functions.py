@@ -96,8 +96,7 @@ def test_create_graph_with_components():
     cache.add_dependency('lib4.so', 'lib6.so')
     cache.set_component_libraries('comp', ['lib3.so', 'lib4.so'])
 
-    graph = ut.create_libs_graph(cache, ['lib1.so'])
-    ut.replace_libs_with_components(cache, graph)
+    graph = ut.create_components_graph(cache, ['lib1.so'])
     print(graph.to_dot())
 
     assert set(graph.keys) == {'comp', 'lib1.so', 'lib2.so', 'lib5.so', 'lib6.so'}
@@ -131,8 +130,7 @@ def test_create_graph_with_more_components():
     cache.set_component_libraries('comp56', ['lib5.so', 'lib6.so'])
     cache.set_component_libraries('comp7', ['lib7.so'])
 
-    graph = ut.create_libs_graph(cache, ['lib1.so'])
-    ut.replace_libs_with_components(cache, graph)
+    graph = ut.create_components_graph(cache, ['lib1.so'])
     print(graph.to_dot())
 
     assert set(graph.keys) == {'comp34', 'comp56', 'comp7', 'lib1.so', 'lib2.so', 'lib8.so'}
@@ -164,8 +162,7 @@ def test_create_graph_with_components_with_internal_dependencies():
     cache.add_dependency('lib5.so', 'lib6.so')
     cache.set_component_libraries('compx', ['lib2.so', 'lib3.so', 'lib5.so'])
 
-    graph = ut.create_libs_graph(cache, ['lib1.so'])
-    ut.replace_libs_with_components(cache, graph)
+    graph = ut.create_components_graph(cache, ['lib1.so'])
     print(graph.to_dot())
 
     assert set(graph.keys) == {'compx', 'lib1.so', 'lib4.so', 'lib6.so'}
@@ -213,3 +210,30 @@ def test_minimize_deps_list():
     # even if intermediate dep is not in list, prune the leaves
     res = ut.minimize_dependencies_list(cache, ['libdog.so', 'libbird.so'])
     assert res == ['libdog.so']
+
+
+def test_iter_library_files(tmp_path):
+    for name in ['libfoo.so', 'sub/libbar.a', 'sub/deep/libbaz.so', 'sub/readme.txt', 'libqux.so.1']:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    found = {p.relative_to(tmp_path).as_posix() for p in ut.iter_library_files(tmp_path)}
+    assert found == {'libfoo.so', 'sub/libbar.a', 'sub/deep/libbaz.so'}
+
+
+def test_iter_library_files_unreadable_folder(tmp_path, monkeypatch):
+    for name in ['libfoo.so', 'locked/libbar.so']:
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+
+    scandir = ut.os.scandir
+    def locked_scandir(path):
+        if path.endswith('locked'):
+            raise PermissionError(path)
+        return scandir(path)
+    monkeypatch.setattr(ut.os, 'scandir', locked_scandir)
+
+    found = {p.relative_to(tmp_path).as_posix() for p in ut.iter_library_files(tmp_path)}
+    assert found == {'libfoo.so'}
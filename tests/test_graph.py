@@ -1,5 +1,5 @@
 from conan_barbarian.data import Cache
-from conan_barbarian.graphs import DepGraph, prune_arcs, sort_graph
+from conan_barbarian.graphs import DepGraph, prune_arcs, sort_dependencies, sort_graph
 from conan_barbarian.libshelper import sort_by_dependency
 
 
@@ -14,6 +14,24 @@ def test_graph_manipulation():
     assert graph.get_node('B').in_refs == set()
 
 
+def test_graph_keys_follow_changes():
+    graph = DepGraph()
+    graph.add_dependency('A', 'B')
+    assert graph.keys == frozenset({'A', 'B'})
+    graph.add_dependency('B', 'C')
+    assert graph.keys == frozenset({'A', 'B', 'C'})
+    graph.remove_node('A')
+    assert graph.keys == frozenset({'B', 'C'})
+
+
+def test_graph_add_many_dependencies():
+    graph = DepGraph()
+    graph.add_dependencies([('A', 'B'), ('A', 'C'), ('B', 'C'), ('A', 'B')])
+    assert sorted(graph.get_node('A').out_ids) == ['B', 'C']
+    assert graph.get_node('B').out_ids == ['C']
+    assert graph.get_node('C').in_degree == 2
+
+
 def test_graph_visit():
     graph = DepGraph()
     graph.add_dependency('A', 'B')
@@ -46,7 +64,7 @@ def test_graph_sort_1():
     assert a_deps == ['A', 'B', 'C', 'D']
 
     for node in graph.nodes:
-        assert len(node.data) == 0
+        assert node.shape is None and node.color is None
 
 
 def test_graph_sort_case_2():
@@ -84,6 +102,23 @@ def test_graph_sort_case_3():
     assert sorted_libs == ['A', 'M', 'B', 'N', 'C', 'O']
 
 
+def test_sort_dependencies_matches_graph_sort():
+    dependencies = {
+        'M': ['N'],
+        'N': ['O'],
+        'A': ['B', 'C'],
+        'B': ['C'],
+        'D': ['C'],
+    }
+    graph = DepGraph()
+    for src, targets in dependencies.items():
+        for tgt in targets:
+            graph.add_dependency(src, tgt)
+
+    assert sort_dependencies(dependencies) == ['A', 'D', 'M', 'B', 'N', 'C', 'O']
+    assert sort_dependencies(dependencies) == sort_graph(graph)
+
+
 # Up one logic level: sort libraries from cache
 
 
@@ -176,6 +211,44 @@ def test_graph_pruning_simple_case():
     assert set(pruned.get_node('C').out_ids) == set()
 
 
+def test_graph_pruning_in_place():
+    graph = DepGraph()
+    graph.add_dependency('A', 'B')
+    graph.add_dependency('A', 'C')
+    graph.add_dependency('B', 'C')
+
+    pruned = prune_arcs(graph, in_place=True)
+
+    assert pruned is graph
+    assert set(graph.get_node('A').out_ids) == {'B'}
+    assert set(graph.get_node('B').out_ids) == {'C'}
+    assert {n.name for n in graph.get_node('C').in_refs} == {'B'}
+
+
+def cyclic_graph():
+    graph = DepGraph()
+    graph.add_dependency('A', 'B')
+    graph.add_dependency('A', 'C')
+    graph.add_dependency('B', 'C')
+    graph.add_dependency('C', 'D')
+    graph.add_dependency('D', 'C')
+    graph.add_dependency('A', 'D')
+    graph.add_dependency('D', 'E')
+    return graph
+
+
+def test_graph_pruning_with_cycles():
+    pruned = prune_arcs(cyclic_graph())
+    in_place = prune_arcs(cyclic_graph(), in_place=True)
+
+    assert pruned.keys == frozenset({'A', 'B', 'C', 'D', 'E'})
+    assert in_place.keys == pruned.keys
+    for name in pruned.keys:
+        assert set(pruned.get_node(name).out_ids) == set(in_place.get_node(name).out_ids)
+    assert set(pruned.get_node('C').out_ids) == {'D'}
+    assert set(pruned.get_node('D').out_ids) == {'C', 'E'}
+
+
 def test_graph_pruning_all_way_down():
     graph = DepGraph()
     graph.add_dependency('A', 'B')
@@ -198,3 +271,30 @@ def test_graph_pruning_all_way_down():
     assert set(pruned.get_node('C').out_ids) == {'D'}
     assert set(pruned.get_node('D').out_ids) == {'E'}
     
+
+
+def test_graph_pruning_long_paths():
+    """
+    graph {
+        A -> C -> F -> H -> I;
+        B -> E -> F;
+        A -> E; A -> G; B -> G; E -> G; B -> F; C -> I; D -> H; D -> I;
+    }
+    """
+    graph = DepGraph()
+    for src, tgt in [('A', 'C'), ('A', 'E'), ('A', 'G'), ('B', 'E'), ('B', 'F'), ('B', 'G'),
+                     ('C', 'F'), ('C', 'I'), ('D', 'H'), ('D', 'I'), ('E', 'F'), ('E', 'G'),
+                     ('F', 'H'), ('H', 'I')]:
+        graph.add_dependency(src, tgt)
+
+    pruned = prune_arcs(graph)
+    print(pruned.to_dot())
+
+    assert pruned.keys == graph.keys
+    assert set(pruned.get_node('A').out_ids) == {'C', 'E'}
+    assert set(pruned.get_node('B').out_ids) == {'E'}
+    assert set(pruned.get_node('C').out_ids) == {'F'}
+    assert set(pruned.get_node('D').out_ids) == {'H'}
+    assert set(pruned.get_node('E').out_ids) == {'F', 'G'}
+    assert set(pruned.get_node('F').out_ids) == {'H'}
+    assert set(pruned.get_node('H').out_ids) == {'I'}
@@ -1,6 +1,7 @@
 from conan_barbarian.data import Cache
-from conan_barbarian.scraping import _parse_nm_output, _parse_link_script, _update_cache
+from conan_barbarian.scraping import _parse_nm_output, _parse_link_script, _update_cache, _read_line_blocks
 from pathlib import Path
+import io
 
 
 def test_parse_nm():
@@ -29,6 +30,41 @@ def test_parse_nm_strange_case_ut():
     assert undefined == []
 
 
+def test_parse_nm_archive_and_versioned_symbols():
+    dump = b"""
+libfoo.a:
+
+foo.o:
+0000000000000010 T foo(char const*)
+                 U memcpy@GLIBC_2.14
+                 U strlen@@GLIBC_2.2.5
+0000000000000000 r .LC0
+"""
+    defined, undefined = _parse_nm_output(dump)
+    assert defined == ['foo(char const*)']
+    assert undefined == ['memcpy', 'strlen']
+
+
+def test_parse_nm_lines():
+    lines = [
+        b"0000000000001090 T ns::func(int)\n",
+        b"                 U malloc\n",
+    ]
+    defined, undefined = _parse_nm_output(iter(lines))
+    assert defined == ['ns::func(int)']
+    assert undefined == ['malloc']
+
+
+def test_parse_nm_blocks():
+    dump = b"""0000000000001090 T ns::func(int)
+                 U malloc
+0000000000002000 W ns::weak_func()
+                 U free@GLIBC_2.2.5"""
+    defined, undefined = _parse_nm_output(_read_line_blocks(io.BytesIO(dump), 16))
+    assert defined == ['ns::func(int)', 'ns::weak_func()']
+    assert undefined == ['malloc', 'free']
+
+
 def test_parse_ld_script(tmpdir):
     script = """
 /* GNU ld script
@@ -46,6 +82,19 @@ GROUP ( /lib64/libm.so.6  AS_NEEDED ( /lib64/libmvec.so.1 ) )
     assert set(libs) == {'/lib64/libm.so.6', '/lib64/libpthread.so'}
 
 
+def test_parse_ld_script_multiline_group(tmpdir):
+    script = """/* GNU ld script */
+GROUP ( /lib64/libc.so.6 /* the static part */ /usr/lib64/libc_nonshared.a
+        AS_NEEDED ( /lib64/ld-linux-x86-64.so.2 ) )
+INPUT(/lib64/liba.so/* glued */libb.so)
+"""
+    script_path = Path(tmpdir, 'script.so')
+    script_path.write_text(script)
+
+    libs = _parse_link_script(script_path)
+    assert libs == ['/lib64/libc.so.6', '/usr/lib64/libc_nonshared.a', '/lib64/liba.so', 'libb.so']
+
+
 def test_update_cache_first_lib():
     s1 = "func1(int, int)"
     s2 = "func2(unsigned int)"